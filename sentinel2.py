@@ -52,10 +52,23 @@ options:
     --record_duration=INT        record time (s)                [default: 10]
 
     --non_gui                    run without GUI (no window display)
+
+    --camera_buffer_size=INT     camera frame buffer size       [default: 1]
+
+    --detection_scale=FLOAT      scale of frames used for motion detection
+                                                                [default: 0.25]
+
+    --detection_stride=INT       run detection every Nth frame  [default: 2]
+
+    --display_fps=INT            preview display rate (FPS)     [default: 15]
 """
 
+import concurrent.futures
+import queue
+import re
 import socket
 import subprocess
+import threading
 import time
 
 import cv2
@@ -66,15 +79,30 @@ __version__  = "2025-01-08T2222ZS"
 
 options = docopt.docopt(__doc__, version=__version__)
 
-last_msg_time = 0
+last_msg_time = None
+signal_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
 
 phone_number    = None if options["--phone_number"].lower() == "none" else options["--phone_number"]
 threshold       = int(options["--detection_threshold"])
 delay_launch    = int(options["--launch_delay"])
 duration_record = int(options["--record_duration"])
 non_gui_mode    = options["--non_gui"]
+buffer_size     = int(options["--camera_buffer_size"])
+detection_scale = float(options["--detection_scale"])
+detect_stride   = int(options["--detection_stride"])
+display_fps     = int(options["--display_fps"])
 host_name       = socket.gethostname()
 
+if detection_scale <= 0:
+    print("--detection_scale must be greater than 0")
+    exit()
+if detect_stride < 1:
+    print("--detection_stride must be at least 1")
+    exit()
+if display_fps < 1:
+    print("--display_fps must be at least 1")
+    exit()
+
 print(f'sentinel2 version {__version__}')
 print('press \'q\' to quit')
 print(f'phone number:    {phone_number}')
@@ -82,90 +110,226 @@ print(f'threshold:       {threshold}')
 print(f'launch delay:    {delay_launch}')
 print(f'record duration: {duration_record}')
 print(f'non-GUI mode:    {non_gui_mode}')
+print(f'buffer size:     {buffer_size}')
+print(f'detection scale: {detection_scale}')
+print(f'detect stride:   {detect_stride}')
+print(f'display FPS:     {display_fps}')
+
+def run_signal_cli(sender_number, recipient_number, message):
+    # Send a Signal message using the signal-cli command-line utility.
+    try:
+        subprocess.run(
+            ["signal-cli", "-a", sender_number, "send", recipient_number, "-m", message],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            check=True)
+    except Exception as e:
+        print(f"error sending Signal message: {e}")
 
 def send_signal_message(
     sender_number    = phone_number,
     recipient_number = phone_number,
     message          = "motion detected"
     ):
+    # Send in the background so that signal-cli does not stall capture; sends
+    # are serialised by the single worker.
     global last_msg_time
-    current_time = time.time()
-    if current_time - last_msg_time < 30:
-        return False
-    try:
-        cmd = f'signal-cli -a {sender_number} send {recipient_number} -m "{message}"'
-        output = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT)
-        last_msg_time = current_time
-        return True
-    except Exception as e:
-        print(f"error sending Signal message: {e}")
+    current_time = time.monotonic()
+    if last_msg_time is not None and current_time - last_msg_time < 30:
         return False
+    signal_executor.submit(run_signal_cli, sender_number, recipient_number, message)
+    last_msg_time = current_time
+    return True
 
 def actions_on_motion_detection():
+    global recording, recording_slot
     message = time.strftime('%Y-%m-%dT%H%M%SZ', time.gmtime()) + " " + host_name + " motion detected"
     print(message)
     if phone_number:
         send_signal_message(message=message)
 
-    start_time = time.time()
-    frames = []
-
-    # Count the number of frames from the start time for saving purposes.
-    while int(time.time() - start_time) < duration_record:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    # Take the first frame to size the video file, and open it before capturing
+    # so that frames are written as they are captured.
+    item = read_q.get()
+    if item is None:
+        # Leave the sentinel for the main loop to see.
+        read_q.put(None)
+        return
+    frame_time, frame = item
+
+    # The timestamp geometry depends only on its length, so measure it once.
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = 0.5
+    font_thickness = 1
+    (text_width, text_height), _ = cv2.getTextSize("0000-00-00T000000Z", font, font_scale, font_thickness)
+
+    frame_height = frame.shape[0]
+    frame_width = frame.shape[1]
+    new_frame_height = frame_height + text_height + 10
+
+    # Text position within the band under the frame.
+    text_x = int((frame_width - text_width) / 2)
+    text_y = text_height
+
+    print(f"Writing video at ~{CAMERA_FPS} FPS.")
+    filename = time.strftime('%Y-%m-%dT%H%M%SZ', time.gmtime()) + '.mp4'
+    write_q.put(open_video_writer(filename, CAMERA_FPS, (frame_width, new_frame_height)))
 
-        timestamp = time.strftime('%Y-%m-%dT%H%M%SZ', time.gmtime())
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        font_scale = 0.5
-        font_thickness = 1
-        (text_width, text_height), _ = cv2.getTextSize(timestamp, font, font_scale, font_thickness)
-        
-        frame_height = frame.shape[0]
-        frame_width = frame.shape[1]
-        new_frame_height = frame_height + text_height + 10
-
-        new_frame = np.zeros((new_frame_height, frame_width, 3), dtype=np.uint8)
-        new_frame[0:frame_height, 0:frame_width] = frame
-
-        text_x = int((frame_width - text_width) / 2)
-        text_y = frame_height + text_height
-
-        cv2.putText(
-            new_frame,
-            timestamp,
-            (text_x, text_y),
-            font,
-            font_scale,
-            (255, 255, 255),
-            font_thickness
+    # Release the video file however the recording ends, including on
+    # KeyboardInterrupt, so that the footage already written is kept.
+    try:
+        # Build frames in the next slot of the recording ring buffer, which is
+        # allocated once and reused by later recordings. The slot index
+        # carries on across recordings, and the writer thread holds at most a
+        # queue's worth of slots, so it has finished with a slot (even one from
+        # the previous recording) before it comes round again. A reallocated
+        # ring leaves slots still queued in the old array untouched.
+        if recording is None or recording.shape[1:3] != (new_frame_height, frame_width):
+            recording = np.empty((write_q.maxsize + 2, new_frame_height, frame_width, 3), dtype=np.uint8)
+
+        # The timestamp band under the frame is drawn once per second and
+        # copied into each slot, so that per frame only the two regions are
+        # copied.
+        band = np.empty((new_frame_height - frame_height, frame_width, 3), dtype=np.uint8)
+
+        # The file is written at CAMERA_FPS, but frames arrive more slowly
+        # whenever the writer falls behind and stale frames are skipped. To
+        # keep the clip playing in real time, each frame is written as many
+        # times as the capture timestamps call for: repeated to cover frames
+        # that were skipped, dropped if it arrives before the next is due.
+        # Repeats are the same slot queued again, so they cost the encoder but
+        # no copying.
+        start_time = frame_time
+        frame_count = 0
+        written = 0
+        second = None
+
+        # Count the number of frames from the start time for saving purposes.
+        while True:
+            # Redraw the timestamp only when the second changes.
+            now = time.time()
+            if int(now) != second:
+                second = int(now)
+                timestamp = time.strftime('%Y-%m-%dT%H%M%SZ', time.gmtime(second))
+                band.fill(0)
+                cv2.putText(
+                    band,
+                    timestamp,
+                    (text_x, text_y),
+                    font,
+                    font_scale,
+                    (255, 255, 255),
+                    font_thickness
+                )
+
+            due = int((frame_time - start_time) * CAMERA_FPS) + 1 - written
+            if due > 0:
+                new_frame = recording[recording_slot % len(recording)]
+                recording_slot += 1
+                np.copyto(new_frame[:frame_height], frame)
+                np.copyto(new_frame[frame_height:], band)
+
+                for _ in range(due):
+                    write_q.put(new_frame)
+                written += due
+            frame_count += 1
+
+            if int(frame_time - start_time) >= duration_record:
+                break
+            item = read_q.get()
+            if item is None:
+                # Leave the sentinel for the main loop to see.
+                read_q.put(None)
+                break
+            frame_time, frame = item
+    finally:
+        # Tell the writer thread to release the video file.
+        write_q.put(None)
+
+    total_time = frame_time - start_time
+    print(f"Recorded {frame_count} frames in {total_time:.2f} seconds, written as {written} frames.")
+
+def open_video_writer(filename, fps, size):
+    # Open a video file for writing as H.264 through the FFmpeg backend, asking
+    # for hardware acceleration, otherwise (if no H.264 encoder opens) as
+    # software MPEG-4. FFmpeg may pick an encoder such as h264_v4l2m2m that
+    # runs in hardware without OpenCV reporting an acceleration type, so the
+    # reported type is only logged. After a failed attempt, later recordings go
+    # straight to MPEG-4.
+    global hardware_encoding
+    if hardware_encoding:
+        out = cv2.VideoWriter(
+            filename,
+            cv2.CAP_FFMPEG,
+            cv2.VideoWriter_fourcc(*'avc1'),
+            fps,
+            size,
+            [cv2.VIDEOWRITER_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
         )
-
-        frames.append(new_frame)
-
-    end_time = time.time()
-    total_time = end_time - start_time
-    frame_count = len(frames)
-
-    if total_time > 0:
-        actual_fps = frame_count / total_time
-    else:
-        actual_fps = 10.0 # fallback
-
-    print(f"Recorded {frame_count} frames in {total_time:.2f} seconds.")
-    print(f"Writing video at ~{actual_fps:.2f} FPS.")
-
-    filename = time.strftime('%Y-%m-%dT%H%M%SZ', time.gmtime()) + '.mp4'
+        if out.isOpened():
+            acceleration = out.get(cv2.VIDEOWRITER_PROP_HW_ACCELERATION)
+            print(f"encoder: H.264 (acceleration: {hardware_encoders.get(acceleration, 'none reported')})")
+            return out
+        out.release()
+        hardware_encoding = False
+    print("encoder: mp4v")
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    frame_height = frames[0].shape[0]
-    frame_width = frames[0].shape[1]
-    out = cv2.VideoWriter(filename, fourcc, actual_fps, (frame_width, frame_height))
-
-    for f in frames:
-        out.write(f)
+    return cv2.VideoWriter(filename, fourcc, fps, size)
+
+def find_motion_contours(fgmask):
+    # Find the contours of the detection mask, a host-side array, scaled back up
+    # to the frame.
+    contours, _ = cv2.findContours(fgmask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return [(c / detection_scale).astype(np.int32) for c in contours]
+
+def read_latest_frame(max_stale=4):
+    # Grab frames until one has to be waited for, skipping stale frames left in
+    # the driver buffer, then decode only the newest. A grab that returns in
+    # under 1 ms was served from the buffer rather than from the sensor.
+    for _ in range(max_stale + 1):
+        start = time.perf_counter()
+        if not cap.grab():
+            return False, None
+        if time.perf_counter() - start >= 0.001:
+            break
+    return cap.retrieve()
+
+def read_frames():
+    # Read frames from the camera into the read queue, with their capture times,
+    # until shutdown. A None sentinel is queued if the camera stops delivering
+    # frames.
+    while not stop_event.is_set():
+        ret, frame = read_latest_frame()
+        if not ret:
+            stop_event.set()
+            read_q.put(None)
+            break
+        # Make sure OpenCV and np.copyto get a C-contiguous array; this is a
+        # no-op for frames that already are, and otherwise copies here rather
+        # than on the main thread.
+        read_q.put((time.monotonic(), np.ascontiguousarray(frame)))
+
+def write_frames():
+    # Write recorded frames to the current video file. A VideoWriter on the
+    # queue starts a new file and a None sentinel releases it.
+    out = None
+    while True:
+        item = write_q.get()
+        if isinstance(item, cv2.VideoWriter):
+            out = item
+        elif item is None:
+            out.release()
+            out = None
+        else:
+            out.write(item)
+        write_q.task_done()
 
-    out.release()
+# A device block in v4l2-ctl --list-devices output: a name, optionally followed
+# by bus information in parentheses, then a colon and an indented device path
+# per line.
+device_block_pattern = re.compile(
+    r'^(.+?)(?:\s*\([^)]+\))?\s*:\s*\n((?:\s+/dev/\S+\n?)+)',
+    re.MULTILINE)
 
 def list_camera_devices():
     # List available camera devices using the v4l2-ctl command-line utility.
@@ -174,17 +338,22 @@ def list_camera_devices():
         output = subprocess.check_output(
             ["v4l2-ctl", "--list-devices"],
             stderr=subprocess.STDOUT)
-        blocks = output.decode("utf-8").split("\n\n")
-        for block in blocks:
-            if "/dev/video" in block:
-                lines = block.strip().split("\n")
-                name = lines[0].strip()
-                paths = [line.strip() for line in lines[1:] if '/dev/video' in line]
-                devices.append((name, paths))
+        for name, paths_block in device_block_pattern.findall(output.decode("utf-8")):
+            paths = [path for path in paths_block.split() if path.startswith("/dev/video")]
+            if paths:
+                devices.append((name.strip(), paths))
     except Exception:
         pass
     return devices
 
+# Names of hardware acceleration types OpenCV's FFmpeg writer can report.
+hardware_encoders = {
+    cv2.VIDEO_ACCELERATION_VAAPI: "VAAPI",
+    cv2.VIDEO_ACCELERATION_MFX:   "MFX",
+    cv2.VIDEO_ACCELERATION_D3D11: "D3D11",
+}
+hardware_encoding = True
+
 # Prompt the user to select a camera device.
 devices = list_camera_devices()
 if not devices:
@@ -215,47 +384,177 @@ paths = devices[selection][1]
 for path in paths:
     cap = cv2.VideoCapture(path)
     if cap.isOpened():
+        # Keep the driver buffer short so that frames are not stale by the time
+        # they are processed.
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
         print(f"camera device {selection}: {devices[selection][0]} ({path}) open")
         break
 else:
     print("Failed to open camera device.")
     exit()
 
-# Create a background subtractor.
-fgbg = cv2.createBackgroundSubtractorMOG2()
+# Measure the camera frame rate once, for writing recordings, by timing a burst
+# of frames after the first has been read.
+if not cap.read()[0]:
+    print("Failed to grab frame.")
+    exit()
+start_time = time.perf_counter()
+for _ in range(30):
+    if not cap.read()[0]:
+        # Failed reads return at once and would inflate the rate.
+        print("Failed to grab frame.")
+        exit()
+elapsed = time.perf_counter() - start_time
+CAMERA_FPS = round(30 / elapsed) if elapsed > 0 else 0
+if CAMERA_FPS < 1:
+    CAMERA_FPS = 10 # fallback
+print(f'camera FPS:      {CAMERA_FPS}')
+
+# Queues linking the reader thread, the main (detection) thread and the writer
+# thread.
+read_q      = queue.Queue(maxsize=2)
+write_q     = queue.Queue(maxsize=32)
+stop_event  = threading.Event()
+recording   = None
+recording_slot = 0
+
+reader = threading.Thread(target=read_frames, daemon=True)
+writer = threading.Thread(target=write_frames, daemon=True)
+reader.start()
+writer.start()
+
+# Create a background subtractor, on the GPU if a CUDA device is available.
+use_cuda = hasattr(cv2, "cuda") and cv2.cuda.getCudaEnabledDeviceCount() > 0
+print(f'CUDA:            {use_cuda}')
+# A 3x3 opening removes speckle noise from the foreground mask.
+kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+if use_cuda:
+    fgbg      = cv2.cuda.createBackgroundSubtractorMOG2()
+    gpu_frame = cv2.cuda_GpuMat()
+    stream    = cv2.cuda.Stream()
+    gpu_open  = cv2.cuda.createMorphologyFilter(cv2.MORPH_OPEN, cv2.CV_8UC1, kernel)
+else:
+    fgbg = cv2.createBackgroundSubtractorMOG2()
+    # Otherwise let OpenCV's transparent API run detection as OpenCL kernels
+    # where a device is available.
+    cv2.ocl.setUseOpenCL(True)
+    print(f'OpenCL:          {cv2.ocl.haveOpenCL()}')
+
+def monitor():
+    # Run detection on frames from the reader thread until the camera stops or
+    # the user quits. Methods and functions used per frame are bound to locals
+    # first, saving their attribute lookups on every iteration.
+    _get     = read_q.get
+    _resize  = cv2.resize
+    _UMat    = cv2.UMat
+    _apply   = fgbg.apply
+    _count   = cv2.cuda.countNonZero if use_cuda else cv2.countNonZero
+    _morph   = cv2.morphologyEx
+    _OPEN    = cv2.MORPH_OPEN
+    _find    = find_motion_contours
+    _draw    = cv2.drawContours
+    _imshow  = cv2.imshow
+    _wait    = cv2.waitKey
+    _AREA    = cv2.INTER_AREA
+    _QUIT    = ord('q')
+    _now     = time.monotonic
+
+    history   = fgbg.getHistory()
+    frame_idx = 0
+    contours  = []
+
+    # Throttle the preview, whose imshow and waitKey cost is wasted above the
+    # rate a person can follow; 'q' is still polled at this rate.
+    show_interval = 1.0 / display_fps
+    last_show     = 0.0
+
+    # The threshold in detection mask pixels. The mask is binary, so its count
+    # of foreground pixels is about the area of its contours. An opening only
+    # removes foreground pixels, so when the raw mask is already under the
+    # threshold the opened one is too, and in non-GUI mode the opening is
+    # skipped.
+    mask_threshold = threshold * detection_scale ** 2
 
-try:
     while True:
-        # Read the current frame.
-        ret, frame = cap.read()
-        if not ret:
+        # Get the current frame from the reader thread.
+        item = _get()
+        if item is None:
             print("Failed to grab frame.")
             break
-
-        # Apply the background subtractor.
-        fgmask = fgbg.apply(frame)
-        # Find contours in the mask.
-        contours, _ = cv2.findContours(fgmask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        # Draw the contours on the original frame.
-        cv2.drawContours(frame, contours, -1, (0, 255, 0), 2)
-        # Calculate the total contour area.
-        total_area = sum(cv2.contourArea(c) for c in contours)
-        # Check if the total area exceeds the threshold.
-        if total_area > threshold:
-            actions_on_motion_detection()
-
-        if not non_gui_mode:
-            # Show the output.
-            cv2.imshow('sentinel2', frame)
+        _, frame = item
+
+        # Run detection every detect_stride frames only; motion persists
+        # across frames, so little is lost by skipping the rest.
+        if frame_idx % detect_stride == 0:
+            # Scale up MOG2's automatic learning rate, 1/min(2n, history) for
+            # the nth frame applied, so that the background adapts at the
+            # same rate in time despite the skipped frames.
+            n = frame_idx // detect_stride + 1
+            learning_rate = min(1.0, detect_stride / min(2 * n, history))
+            # Downscale the frame for detection; only the detector sees it.
+            # On the CPU path the frame is wrapped in a UMat, so the resize,
+            # MOG2 and mask reductions run through OpenCL when it is
+            # available.
+            small = _resize(
+                frame if use_cuda else _UMat(frame),
+                (0, 0),
+                fx=detection_scale,
+                fy=detection_scale,
+                interpolation=_AREA
+            )
+            if use_cuda:
+                # Apply the background subtractor on the GPU, only
+                # downloading the mask when it is to be drawn.
+                gpu_frame.upload(small, stream)
+                gpu_mask = _apply(gpu_frame, learning_rate, stream)
+                stream.waitForCompletion()
+                motion_pixels = _count(gpu_mask)
+                if not non_gui_mode or motion_pixels > mask_threshold:
+                    gpu_mask = gpu_open.apply(gpu_mask, stream=stream)
+                    stream.waitForCompletion()
+                    motion_pixels = _count(gpu_mask)
+                if not non_gui_mode:
+                    contours = _find(gpu_mask.download()) if motion_pixels > 0 else []
+            else:
+                # Apply the background subtractor and denoise the mask.
+                fgmask = _apply(small, learningRate=learning_rate)
+                motion_pixels = _count(fgmask)
+                if not non_gui_mode or motion_pixels > mask_threshold:
+                    _morph(fgmask, _OPEN, kernel, dst=fgmask)
+                    motion_pixels = _count(fgmask)
+                if not non_gui_mode:
+                    # The mask is a UMat; contours are scaled on the host, so
+                    # download it first.
+                    contours = _find(fgmask.get()) if motion_pixels > 0 else []
+            # Check if the motion area exceeds the threshold.
+            if motion_pixels > mask_threshold:
+                actions_on_motion_detection()
+        frame_idx += 1
+
+        if not non_gui_mode and _now() - last_show >= show_interval:
+            last_show = _now()
+            # Draw the most recent contours and show the output.
+            _draw(frame, contours, -1, (0, 255, 0), 2)
+            _imshow('sentinel2', frame)
             # Check if the user pressed the 'q' key.
-            if cv2.waitKey(1) & 0xFF == ord('q'):
+            if _wait(1) & 0xFF == _QUIT:
                 break
-        else:
-            # In non-GUI mode, add a small sleep to prevent high CPU usage.
-            time.sleep(0.01)
+
+try:
+    monitor()
 except KeyboardInterrupt:
     print("Interrupted by user. Exiting...")
 
+# Stop the reader thread, unblocking it if it is waiting on a full queue, and
+# wait for any recording still queued to be written.
+stop_event.set()
+try:
+    read_q.get_nowait()
+except queue.Empty:
+    pass
+reader.join(timeout=1)
+write_q.join()
+
 # Release the VideoCapture object and close windows.
 cap.release()
 cv2.destroyAllWindows()